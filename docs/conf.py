@@ -7,8 +7,13 @@
 # https://www.sphinx-doc.org/en/master/usage/configuration.html#project-information
 import sys
 import os
+import re
 sys.path.insert(0,os.path.abspath('..'))
-from toui import __version__
+
+# The version is read from the source so that `toui` is only imported once, by autodoc, after
+# `autodoc_mock_imports` is applied.
+with open(os.path.join(os.path.abspath('..'), "toui", "__init__.py"), "rt") as file:
+    __version__ = re.search(r'__version__ = "(.+)"', file.read()).group(1)
 
 project = 'ToUI'
 copyright = '2023, Mubarak Almehairbi'
@@ -23,13 +28,18 @@ extensions = ['sphinx.ext.viewcode','sphinx.ext.autodoc', 'sphinx.ext.napoleon',
               'sphinx.ext.autosummary', 'myst_parser', 'sphinx.ext.intersphinx']
 autodoc_default_flags = ['members']
 autoclass_content = 'both'
+autodoc_mock_imports = ['flask_login', 'flask_sqlalchemy', 'sqlalchemy', 'flask_basicauth', 'firebase_admin', 'google',
+                        'stripe']
+# Each inventory is read from `_inventories/<name>.inv` when it was downloaded beforehand, otherwise
+# it is fetched from the website.
 intersphinx_mapping = {
-    "flask": ("https://flask.palletsprojects.com/en/2.2.x/", None),
-    "werkzeug": ("https://werkzeug.palletsprojects.com/en/2.2.x/", None),
-    "bs4": ("https://www.crummy.com/software/BeautifulSoup/bs4/doc/", None),
-    "simple_websocket": ("https://simple-websocket.readthedocs.io/en/latest/", None),
-    "flask_sock": ("https://flask-sock.readthedocs.io/en/latest/", None),
+    "flask": ("https://flask.palletsprojects.com/en/2.2.x/", ("_inventories/flask.inv", None)),
+    "werkzeug": ("https://werkzeug.palletsprojects.com/en/2.2.x/", ("_inventories/werkzeug.inv", None)),
+    "bs4": ("https://www.crummy.com/software/BeautifulSoup/bs4/doc/", ("_inventories/bs4.inv", None)),
+    "simple_websocket": ("https://simple-websocket.readthedocs.io/en/latest/", ("_inventories/simple_websocket.inv", None)),
+    "flask_sock": ("https://flask-sock.readthedocs.io/en/latest/", ("_inventories/flask_sock.inv", None)),
 }
+intersphinx_timeout = 5
 autosummary_generate = False
 html_logo = "images/logo.png"
 templates_path = ['_templates']
@@ -1,4 +1,5 @@
 import glob
+import hashlib
 import os
 import shutil
 import subprocess
@@ -7,9 +8,9 @@ sys.path.append("..")
 from toui import Website, DesktopApp, Page, Element, IFrameElement,\
     ToUIBlueprint, RedirectingPage, quick_website, quick_desktop_app, set_global_app, get_global_app, __version__
 from toui._signals import File
-from docs.rst_objects import Index, Section, MD, Class, Example, Function
+from docs.rst_objects import Index, Section, MD, Class, Example, Function, save_examples_cache, write_rst_files
 
-clear = True
+clear = "--clean" in sys.argv
 run = True
 
 if clear:
@@ -20,37 +21,40 @@ if clear:
 classes = []
 for cls in (Website, DesktopApp, Page, Element):
     cls_object = Class(cls)
-    cls_object.to_rst()
     classes.append(cls_object)
 
 other_objects = []
 for cls in (IFrameElement, File):
     cls_object = Class(cls)
-    cls_object.to_rst()
     other_objects.append(cls_object)
 cls_object = Class(ToUIBlueprint)
 cls_object.no_inherit_methods = True
-cls_object.to_rst()
 other_objects.append(cls_object)
 
 cls_object = Class(RedirectingPage)
 cls_object.no_inherit_methods = True
-cls_object.to_rst()
 other_objects.append(cls_object)
 
 functions = []
 for func in (quick_website, quick_desktop_app, set_global_app, get_global_app):
     func_object = Function(func)
-    func_object.to_rst()
     functions.append(func_object)
 
 examples = []
 examples_paths = [p for p in glob.glob("../examples/*.py") if not os.path.basename(p).startswith("_")]
+examples_hashes = set()
 for example in examples_paths:
+    with open(example, "rb") as file:
+        example_hash = hashlib.blake2b(file.read()).digest()
+    if example_hash in examples_hashes:
+        continue
+    examples_hashes.add(example_hash)
     example_object = Example(path=example)
-    example_object.to_rst()
     examples.append(example_object)
+save_examples_cache()
 
+for rst_object in classes + other_objects + functions + examples:
+    rst_object.to_rst()
 
 sections = []
 section_api = Section(title="API Reference", autosummary=True, heading="Main classes", children=classes,
@@ -91,8 +95,11 @@ sections.append(section_md)
 
 index = Index(package_title="ToUI", readme_path="../README.md", sections=sections, version_text=f"Version: {__version__}")
 index.to_rst()
+write_rst_files()
 
 
 if run:
-    os.system("make clean")
-    os.system("make html")
+    from sphinx.cmd.build import build_main
+    if clear:
+        shutil.rmtree("_build", ignore_errors=True)
+    build_main(["-b", "html", "-j", "auto", "-d", "_build/doctrees", ".", "_build/html"])
@@ -1,8 +1,31 @@
 import ast
 import inspect
 import os
+import pickle
+import re
 from dataclasses import dataclass, field
+from functools import lru_cache
 
+try:
+    from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+    os.makedirs(".jinja_cache", exist_ok=True)
+    _ENV = Environment(loader=FileSystemLoader("_my_templates"), auto_reload=False, keep_trailing_newline=True,
+                       bytecode_cache=FileSystemBytecodeCache(".jinja_cache"))
+except ModuleNotFoundError:
+    _ENV = None
+
+_PLACEHOLDER = re.compile(r"\{\{(\w+)\}\}")
+_UNDERLINES = {"=": "=" * 512, "-": "-" * 512}
+
+_rst_files = {}
+
+_EXAMPLES_CACHE_FILE = ".examples_cache.pkl"
+# Maps the path of an example to its modification time and parsed parts
+_examples_cache = {}
+_examples_seen = {}
+if os.path.exists(_EXAMPLES_CACHE_FILE):
+    with open(_EXAMPLES_CACHE_FILE, "rb") as cache_file:
+        _examples_cache = pickle.load(cache_file)
 
 
 @dataclass
@@ -15,7 +38,7 @@ class Index:
 
     def to_rst(self):
         index_dict = {"title": self.package_title,
-                      "under_title": len(self.package_title) * "=",
+                      "under_title": _underline(self.package_title, "="),
                       "version": self.version_text,
                       "contents": "\n   ".join([s.original_title for s in self.sections])}
         if self.readme_path:
@@ -36,6 +59,9 @@ class Section:
     text: str = ""
     heading: str = ""
 
+    original_title: str = field(default="", init=False)
+    text_rst: str = field(default="", init=False)
+
     def to_rst(self):
         self.original_title = self.title
         children = [c.rst for c in self.children]
@@ -47,12 +73,12 @@ class Section:
             toc = ".. toctree::\n   :maxdepth: 1"
         section_dict = {"title": self.title,
                         "heading": self.heading,
-                        "under_heading": len(self.heading) * "-",
-                        "under_title": len(self.title) * "=",
+                        "under_heading": _underline(self.heading, "-"),
+                        "under_title": _underline(self.title, "="),
                         "text": text,
                         "toc": toc,
                         "contents": contents}
-        replace_template(section_dict, "section_template.txt", f"{self.title}.rst")
+        self.text_rst = replace_template(section_dict, "section_template.txt", f"{self.title}.rst")
 
     def add_rst(self):
         children = [c.rst for c in self.children]
@@ -64,40 +90,48 @@ class Section:
         section_dict = {"title": "",
                         "under_title": "",
                         "heading": self.heading,
-                        "under_heading": len(self.heading) * "-",
+                        "under_heading": _underline(self.heading, "-"),
                         "text": "",
                         "toc": toc,
                         "contents": contents}
         text = replace_template(section_dict, "section_template.txt")
-        with open(f"{self.original_title}.rst", "a") as file:
-            file.write("\n")
-            file.write(text)
+        self.text_rst += "\n" + text
+        _rst_files[f"{self.original_title}.rst"] = self.text_rst
 
 
+@dataclass
 class MD:
 
-    def __init__(self, file):
-        self.file = self.original_title = file
+    file: str
+    original_title: str = field(init=False)
+
+    def __post_init__(self):
+        self.original_title = self.file
 
 
+@dataclass
 class Class:
 
-    no_inherit_methods = False
+    cls: type
+    no_inherit_methods: bool = False
+    cls_api: str = field(init=False)
+    title: str = field(init=False)
+    rst: str = field(init=False)
 
-    def __init__(self, cls):
-        self.cls = cls
+    def __post_init__(self):
         self.cls_api = f"{self.cls.__module__}.{self.cls.__name__}"
         self.title = self.cls.__name__
         self.rst = self.cls_api
 
     def to_rst(self):
         cls_api = f"{self.cls.__module__}.{self.cls.__name__}"
-        methods = [f for f in inspect.getmembers(self.cls, inspect.isfunction) if not f[0].startswith("_")]
+        methods = _public_functions(self.cls)
         if self.no_inherit_methods:
-            methods = [m for m in methods if not hasattr(self.cls.__bases__[0], m[0])]
+            inherited = set(dir(self.cls.__bases__[0]))
+            methods = [m for m in methods if m[0] not in inherited]
         methods_str = "\n   ".join([f"{cls_api}.{m[0]}" for m in methods])
         cls_dict = {"class_name": self.cls.__name__,
-                    "under_class_name": "=" * len(self.cls.__name__),
+                    "under_class_name": _underline(self.cls.__name__, "="),
                     "to_class": cls_api,
                     "methods": f"{methods_str}"}
         if methods != []:
@@ -107,70 +141,126 @@ class Class:
         for method_name, method in methods:
             method_api = f"{cls_api}.{method_name}"
             method_dict = {"method_name": f"{self.cls.__name__}.{method_name}",
-                           "under_method_name": "-" * len(f"{self.cls.__name__}.{method_name}"),
+                           "under_method_name": _underline(f"{self.cls.__name__}.{method_name}", "-"),
                            "to_method": method_api}
             replace_template(method_dict, "method_template.txt", f"{method_api}.rst")
 
 
+@dataclass
 class Function:
 
-    def __init__(self, func):
-        self.func = func
+    func: object
+    func_api: str = field(init=False)
+    title: str = field(init=False)
+    rst: str = field(init=False)
+
+    def __post_init__(self):
         self.func_api = f"{self.func.__module__}.{self.func.__name__}"
         self.title = self.func.__name__
         self.rst = self.func_api
 
     def to_rst(self):
         func_dict = {"func_name": self.func.__name__,
-                    "under_func_name": "=" * len(self.func.__name__),
+                    "under_func_name": _underline(self.func.__name__, "="),
                     "to_func": self.func_api}
         replace_template(func_dict, "function_template.txt", f"{self.func_api}.rst")
 
 
+@dataclass
 class Example:
 
-    title: str = None
     path: str
+    title: str = None
     text: str = None
+    code: str = field(init=False)
+    rst: str = field(init=False)
 
-    def __init__(self, path, title=None, text=None):
-        with open(path, "rt") as file:
-            content = file.read()
-            module = ast.parse(content, type_comments=True)
-        docstring = ast.get_docstring(module).strip().splitlines()
-        docstring_line_0 = docstring[0]
-        self.path = path
-        if title:
-            self.title = title
+    def __post_init__(self):
+        path = self.path
+        mtime = os.path.getmtime(path)
+        cached = _examples_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            docstring_title, docstring_text, code = cached[1]
         else:
-            self.title = docstring_line_0
-        if text:
-            self.text = text
-        else:
-            self.text = "\n".join(docstring[1:]).strip()
-        self.code = ""
-        starting_line_num = module.body[1].lineno - 1
-        lines = content.splitlines()
-        for line in lines[starting_line_num:]:
-            self.code += line + "\n" + "   "
+            with open(path, "rt") as file:
+                content = file.read()
+                module = ast.parse(content)
+            docstring_title, _, docstring_text = ast.get_docstring(module).strip().partition("\n")
+            docstring_text = docstring_text.strip()
+            starting_line_num = module.body[1].lineno - 1
+            lines = content.splitlines()
+            code = "".join(line + "\n   " for line in lines[starting_line_num:])
+        _examples_seen[path] = (mtime, (docstring_title, docstring_text, code))
+        if not self.title:
+            self.title = docstring_title
+        if not self.text:
+            self.text = docstring_text
+        self.code = code
 
     def to_rst(self):
         self.rst = f"Examples.{os.path.basename(self.path).removesuffix('.py')}"
         example_dict = {"title": self.title,
-                        "under_title": len(self.title) * "=",
+                        "under_title": _underline(self.title, "="),
                         "code": self.code,
                         "text": self.text,
                         "path": self.path}
         replace_template(example_dict, "code_template.txt", f"{self.rst}.rst")
 
 
-def replace_template(dictionary, rst_template, new_rst_file=None):
+def save_examples_cache():
+    """
+    Stores the examples parsed in this run so that unchanged examples are not parsed again in the next run. Examples
+    that were removed are left out.
+    """
+    with open(_EXAMPLES_CACHE_FILE, "wb") as cache_file:
+        pickle.dump(_examples_seen, cache_file)
+
+
+def _underline(title, char="="):
+    if len(title) > len(_UNDERLINES[char]):
+        return char * len(title)
+    return _UNDERLINES[char][:len(title)]
+
+
+@lru_cache(maxsize=None)
+def _public_functions(cls):
+    return [f for f in inspect.getmembers(cls, inspect.isfunction) if not f[0].startswith("_")]
+
+
+class _Template:
+    """Substitutes the template placeholders in a single pass. Used when `jinja2` is not installed."""
+
+    def __init__(self, text):
+        self.text = text
+
+    def render(self, dictionary):
+        return _PLACEHOLDER.sub(lambda m: dictionary.get(m.group(1), m.group(0)), self.text)
+
+
+@lru_cache(maxsize=None)
+def _load_template(rst_template):
+    if _ENV is not None:
+        return _ENV.get_template(rst_template)
     with open("_my_templates/" + rst_template, "rt") as template:
-        text = template.read()
-        for key, value in dictionary.items():
-            text = text.replace("{{" + key + "}}", value)
+        return _Template(template.read())
+
+
+def replace_template(dictionary, rst_template, new_rst_file=None):
+    text = _load_template(rst_template).render(dictionary)
     if new_rst_file:
-        with open(new_rst_file, "w") as new_file:
-            print(f"WRITING: {new_rst_file}")
+        _rst_files[new_rst_file] = text
+    return text
+
+
+def write_rst_files():
+    """Writes the generated RST files, skipping the files whose content did not change."""
+    for rst_file, text in _rst_files.items():
+        if os.path.exists(rst_file):
+            with open(rst_file, "rt") as old_file:
+                if old_file.read() == text:
+                    continue
+        print(f"WRITING: {rst_file}")
+        with open(rst_file + ".tmp", "w") as new_file:
             new_file.write(text)
-    return text
\ No newline at end of file
+        os.replace(rst_file + ".tmp", rst_file)
+    _rst_files.clear()
@@ -1,3 +1,4 @@
+import re
 import setuptools
 import sys
 from toui import __version__
@@ -16,17 +17,17 @@ author = "Mubarak Almehairbi"
 description = "Creates user interfaces (websites and desktop apps) from HTML easily"
 package_name = "toui"
 requirements = []
-optional_requirements = ['flask-login', 'flask-sqlalchemy', 'flask-basicauth']
+optional_requirements = ['flask-login', 'flask-sqlalchemy', 'flask-basicauth', 'orjson', 'lxml', 'xxhash']
 
-reqs_txt = open("requirements.txt", "r").read()
-reqs_txt += "\n" + open("optional_requirements.txt", "r").read()
+reqs_txt = ""
+for reqs_file in ("requirements.txt", "optional_requirements.txt"):
+    with open(reqs_file, "r") as file:
+        reqs_txt += file.read() + "\n"
 
-for pkg in reqs_txt.splitlines():
-    pkg_name = pkg.split("==")[0]
+req_pattern = re.compile(r"^([\w.\-]+)==((\d+)[\w.]*)", re.MULTILINE)
+for pkg_name, pkg_version, pkg_major_version in req_pattern.findall(reqs_txt):
     if pkg_name.lower().replace("_","-") in optional_requirements and small:
         continue
-    pkg_version = pkg.split("==")[1]
-    pkg_major_version = pkg_version.split(".")[0]
     req = f"{pkg_name}>={pkg_version},<{int(pkg_major_version)+1}"
     requirements.append(req)
 
@@ -0,0 +1,22 @@
+import unittest
+import sys
+sys.path.append("..")
+from werkzeug.security import generate_password_hash
+from toui.apps import _check_password, _is_password_hash
+
+class MyTestCase(unittest.TestCase):
+    def test_hashed_password(self):
+        stored_password = generate_password_hash("p$123")
+        self.assertTrue(_is_password_hash(stored_password))
+        self.assertTrue(_check_password(stored_password, "p$123"))
+    def test_legacy_password(self):
+        self.assertFalse(_is_password_hash("p$123"))
+        self.assertTrue(_check_password("p$123", "p$123"))
+    def test_wrong_password(self):
+        self.assertFalse(_check_password(generate_password_hash("p123"), "p124"))
+        self.assertFalse(_check_password("p123", "p124"))
+        self.assertFalse(_check_password(None, "p123"))
+
+
+if __name__ == '__main__':
+    unittest.main()
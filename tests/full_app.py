@@ -7,6 +7,9 @@ from toui._helpers import show_debug
 
 show_debug(True)
 
+# Run with `--slow-handler` to make `quick_click` slow, so that clicks sent while it runs are queued
+simulate_slow_handler = "--slow-handler" in sys.argv
+
 ##################################################
 #
 #   App creation and configuration
@@ -150,7 +153,8 @@ def quick_click():
     count = int(pg.get_element("click-count").get_content()) + 1
     pg.get_element("click-count").set_content(count)
     files = pg.get_element("hidden-files-input").get_files()
-    time.sleep(0.5)
+    if simulate_slow_handler:
+        time.sleep(0.5)
 
 
 def resize(w, h):
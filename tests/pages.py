@@ -9,6 +9,22 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(str(page), "<html><button></button></html>")
         button = page.get_elements(tag_name="button")[0]
         self.assertEqual(str(button), "<button></button>")
+    def test_apply_patches(self):
+        page = Page(html_str='<p id="text">old</p><div id="box"><span>1</span><span>2</span></div>')
+        patched = page._apply_patches([{"selector": "p#text", "html": '<p id="text">new</p>'}])
+        self.assertTrue(patched)
+        self.assertEqual(str(page.get_element("text")), '<p id="text">new</p>')
+    def test_apply_nested_patches(self):
+        page = Page(html_str='<div id="box"><span>1</span><span>2</span></div>')
+        patched = page._apply_patches([{"selector": "div#box > span:nth-of-type(2)", "html": "<span>3</span>"}])
+        self.assertTrue(patched)
+        self.assertEqual(str(page.get_element("box")), '<div id="box"><span>1</span><span>3</span></div>')
+    def test_apply_missing_patches(self):
+        page = Page(html_str='<p id="text">old</p><p id="other">old</p>')
+        patched = page._apply_patches([{"selector": "p#text", "html": '<p id="text">new</p>'},
+                                       {"selector": "p#missing", "html": '<p id="missing">new</p>'}])
+        self.assertFalse(patched)
+        self.assertEqual(str(page), '<html><p id="text">old</p><p id="other">old</p></html>')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,48 @@
+import unittest
+import sys
+import time
+import json
+sys.path.append("..")
+from toui._signals import Signal, _start_batch, _end_batch, _BATCH_MAX_DELAY
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.msg_num = 0
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+
+def new_signal(ws, func):
+    signal = Signal()
+    signal.ws = ws
+    return signal, {'func': func, 'args': [], 'kwargs': {}}
+
+
+class MyTestCase(unittest.TestCase):
+    def test_first_signal_is_sent_immediately(self):
+        ws = FakeWebSocket()
+        token = _start_batch(ws)
+        signal, data = new_signal(ws, "first")
+        signal._send(data)
+        self.assertEqual(len(ws.sent), 1)
+        _end_batch(token)
+        self.assertEqual(len(ws.sent), 1)
+    def test_queued_signal_is_sent_while_handler_runs(self):
+        ws = FakeWebSocket()
+        token = _start_batch(ws)
+        for func in ["first", "second", "third"]:
+            signal, data = new_signal(ws, func)
+            signal._send(data)
+        self.assertEqual(len(ws.sent), 1)
+        time.sleep(_BATCH_MAX_DELAY * 4)
+        self.assertEqual(len(ws.sent), 2)
+        self.assertEqual([signal['func'] for signal in ws.sent[1]], ["second", "third"])
+        _end_batch(token)
+        self.assertEqual(len(ws.sent), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,7 @@ import sys
 import os
 import requests
 import zipfile
-import io
+import tempfile
 
 help_text = """
 ToUI Command Line Interface
@@ -35,15 +35,19 @@ optional_reqs = """flask_sqlalchemy==3.0.3
 Flask_BasicAuth==0.2.0
 Flask_Login==0.6.2
 firebase_admin==6.2.0
-stripe==5.5.0"""
+stripe==5.5.0
+orjson==3.9.10
+lxml==4.9.3
+xxhash==3.4.1"""
 
 def install_reqs(reqs):
+    specs = []
     for pkg in reqs.splitlines():
         pkg_name = pkg.split("==")[0]
         pkg_version = pkg.split("==")[1]
         pkg_major_version = pkg_version.split(".")[0]
-        req = f"{pkg_name}>={pkg_version},<{int(pkg_major_version)+1}"
-        subprocess.check_call([sys.executable, '-m', 'pip', 'install', req])
+        specs.append(f"{pkg_name}>={pkg_version},<{int(pkg_major_version)+1}")
+    subprocess.check_call([sys.executable, '-m', 'pip', 'install', *specs])
 
 def main():
     if "--help" in sys.argv or len(sys.argv) == 1:
@@ -54,27 +58,31 @@ def main():
             install_reqs(reqs)
 
         if "--all-reqs" in sys.argv:
-            install_reqs(reqs)
-            install_reqs(optional_reqs)
+            install_reqs(reqs + "\n" + optional_reqs)
     except subprocess.CalledProcessError as e:
         print("An error occured while installing the requirements. Please try again.")
         print(e.output)
     if "init" in sys.argv:
         if not "--full" in sys.argv:
-            response = requests.get("https://github.com/mubarakalmehairbi/BasicToUIProject/archive/master.zip", stream=True)
+            url = "https://github.com/mubarakalmehairbi/BasicToUIProject/archive/master.zip"
             project_name = "MyBasicToUIProject"
         else:
-            response = requests.get("https://github.com/mubarakalmehairbi/FullToUIProject/archive/master.zip")
+            url = "https://github.com/mubarakalmehairbi/FullToUIProject/archive/master.zip"
             project_name = "MyFullToUIProject"
+        existing_names = {entry.name for entry in os.scandir(".")}
         project_path = project_name
-        if os.path.exists(project_path):
-            i = 1
+        i = 0
+        while project_path in existing_names:
+            i += 1
             project_path = f"{project_name}_{i}"
-            while os.path.exists(project_path):
-                i += 1
-                project_path = f"{project_name}_{i}"
-        z = zipfile.ZipFile(io.BytesIO(response.content))
-        z.extractall(project_path)
+        with requests.get(url, stream=True) as response:
+            response.raise_for_status()
+            with tempfile.SpooledTemporaryFile(max_size=8 << 20) as zip_file:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    zip_file.write(chunk)
+                zip_file.seek(0)
+                with zipfile.ZipFile(zip_file) as z:
+                    z.extractall(project_path)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,10 +1,19 @@
 """
 Helper functions and logging.
 """
+# ToUI does not use Numba (or other JIT compilers). Its work is event dispatch, HTML manipulation and WebSocket
+# communication, which a JIT does not speed up, while importing Numba would add a noticeable delay to every start.
+# If a numeric helper is ever needed, import Numba inside that module only and make it optional.
+import json
 import warnings
 import logging
 import traceback
 
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
 logger = logging.getLogger("ToUI")
 logger.level = logging.INFO
 handler = logging.StreamHandler()
@@ -25,6 +34,11 @@ def debug(msg):
     logger.debug(msg=msg)
 
 
+def debug_enabled():
+    """Checks if debug messages are shown, so that expensive messages are only formatted when needed."""
+    return logger.isEnabledFor(logging.DEBUG)
+
+
 def error(e:Exception):
     try:
         err = "".join(traceback.format_exception(e))
@@ -34,18 +48,32 @@ def error(e:Exception):
 
 
 def selector_to_str(tag_name=None, class_name=None, name=None, attrs=None):
-    selectors = ""
+    selectors = []
     if tag_name:
-        selectors += tag_name
+        selectors.append(tag_name)
     if class_name:
-        selectors += f"[class=\"{class_name}\"]"
+        selectors.append(f"[class=\"{class_name}\"]")
     if name:
-        selectors += f"[name=\"{name}\"]"
+        selectors.append(f"[name=\"{name}\"]")
     if attrs:
-        for attr_key, attr_value in attrs.items():
-            if attr_value:
-                selectors += f"[{attr_key}=\"{attr_value}\"]"
-    return selectors
+        selectors.extend(f"[{attr_key}=\"{attr_value}\"]" for attr_key, attr_value in attrs.items() if attr_value)
+    return "".join(selectors)
+
+
+# WebSocket messages are kept as JSON text frames. Binary frames are reserved for the chunks of files being saved
+# (see `File._get_valid_message`), so messages encoded with a binary format such as MessagePack could not be told
+# apart from file data, and pages would also need a MessagePack encoder in the injected script.
+def to_json(obj):
+    """Serializes a message for the WebSocket, using `orjson` if it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def from_json(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 
 def obj_converter(obj):
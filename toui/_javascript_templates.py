@@ -1,6 +1,10 @@
 """
 JavaScript code that is added to HTML files.
 """
+import gzip
+import hashlib
+from functools import lru_cache
+
 template = """
 var conn = "wss"
 if (location.protocol == "http:") {
@@ -13,48 +17,72 @@ socket.addEventListener('message', ev => {
 const urlPath = location.pathname
 const _appType = "{app_type}"
 _touiFiles = {}
+var _touiFileCounter = 0
+var _touiFileIds = new WeakMap()
+const _sendHighWater = 1 << 20
+const _maxPatches = 64
 _pywebviewIsLoaded = false
+var _fullDocNeeded = true
+var _dirtyNodes = new Set()
+var _selectorCache = new WeakMap()
+var _oldIds = new Map()
+var _uid
+var _elementCache = new Map()
+const _idSelector = /^([a-z][a-z0-9-]*)#([\w-]+)$/
+const _domObserver = new MutationObserver(_addDirtyNodes)
+_observeDoc()
 async function _toPy(...args) {
     var func = args.shift()
     if (_appType === "DesktopApp" && _pywebviewIsLoaded == false) {
         await _waitForPywebview()
     }
+    // Everything after this point runs without awaiting, so the messages leave in the order of the events and each
+    // patch is computed after the previous message's patch.
+    var uid = await _getUid()
 
-    var selector_to_element = false
+    var element_args = []
     for (var i = 0; i < args.length; i++) {
         if (args[i] instanceof HTMLElement) {
             args[i] = {type: "element",
                        selector: _getElementSelector(args[i])}
-            selector_to_element = true
+            element_args.push(i)
         }
     }
 
     var json = {type: "page",
                 func: func,
                 args: args,
-                "selector-to-element": selector_to_element,
+                "selector-to-element": element_args.length > 0,
+                "element-args": element_args,
                 url: urlPath}
     _manageProperties()
-    json['html'] = _getDoc()
-    json['uid'] = await _getUid()
+    var patches = _getPatches()
+    if (patches === null) {
+        json['html'] = _getDoc()
+    } else {
+        json['patches'] = patches
+    }
+    json['uid'] = uid
     var jsonstring = JSON.stringify(json)
     if (socket.readyState === 0) {
-        socket.onopen = async function() {
-            socket.send(jsonstring);
-        }
+        socket.addEventListener("open", function() {
+            socket.send(jsonstring)
+        })
     } else {
         socket.send(jsonstring)
     }
 }
 
 async function _getUid() {
-    try {
-        const uid = await pywebview.api.get_uid()
-        return uid
-    } catch (err) {
-        const uid = null
-        return null
+    // The uid of a window does not change, so pywebview is only asked once
+    if (_uid === undefined) {
+        try {
+            _uid = await pywebview.api.get_uid()
+        } catch (err) {
+            return null
+        }
     }
+    return _uid
 }
 
 window.addEventListener('pywebviewready', function () {
@@ -74,47 +102,164 @@ function _send(jsonstring) {
     socket.send(jsonstring)
 }
 
+async function _waitForBufferedAmount() {
+    // Waits until most of the queued data is sent, so that large files are not queued at once.
+    while (socket.bufferedAmount > _sendHighWater) {
+        await new Promise(resolve => setTimeout(resolve, 0))
+    }
+}
+
 function _getDoc() {
-    var serializer = new XMLSerializer()
-    const doc = serializer.serializeToString(document)
-    return doc
+    const doctype = document.doctype
+    if (doctype === null) {
+        return document.documentElement.outerHTML
+    }
+    if (doctype.publicId || doctype.systemId) {
+        var serializer = new XMLSerializer()
+        return serializer.serializeToString(document)
+    }
+    return "<!DOCTYPE " + doctype.name + ">" + document.documentElement.outerHTML
     }
 
 function _setDoc(kwargs) {
     document.open()
     document.write(kwargs['doc'])
     document.close()
+    _observeDoc()
+    _fullDocNeeded = true
+    _elementCache.clear()
     }
-    
-async function _manageProperties() {
-    var properties = {files: []}
-    var input_elements = document.getElementsByTagName("input")
-    for (var input_element of input_elements) {
-        input_element.setAttribute("value", input_element.value)
-        if (input_element.checked == true) {
-            input_element.setAttribute("checked", "")
-        } else {
-            input_element.removeAttribute("checked")
+
+function _observeDoc() {
+    _domObserver.observe(document.documentElement, {subtree: true, childList: true, attributes: true,
+                                                    attributeOldValue: true, characterData: true})
+}
+
+function _addDirtyNodes(mutations) {
+    for (var mutation of mutations) {
+        var node = mutation.target
+        if (mutation.type === "childList" || mutation.attributeName === "id") {
+            _forgetSelectors(node)
+        }
+        if (mutation.attributeName === "id" && !_oldIds.has(node)) {
+            // Python still has the id from before the first change, which `_getPatchSelector` needs
+            _oldIds.set(node, mutation.oldValue)
         }
+        if (node.nodeType !== Node.ELEMENT_NODE) {
+            node = node.parentElement
+        }
+        if (node) {
+            _dirtyNodes.add(node)
+        }
+    }
+}
+
+function _forgetSelectors(root) {
+    // Selectors are paths of ids and `:nth-of-type` indices, so a change of children or of an id only affects
+    // the cached selectors inside `root`.
+    if (root === document.documentElement || root === document.body) {
+        _selectorCache = new WeakMap()
+        return
     }
+    _selectorCache.delete(root)
+    for (var el of root.getElementsByTagName("*")) {
+        _selectorCache.delete(el)
+    }
+}
 
-    var textarea_elements = document.getElementsByTagName("textarea")
-    for (var textarea_element of textarea_elements) {
-        textarea_element.setAttribute("value", textarea_element.value)
+function _getPatches() {
+    // Returns the outer HTML of the elements that changed since the last message, or `null` if the
+    // whole document should be sent instead.
+    _addDirtyNodes(_domObserver.takeRecords())
+    var fullDocNeeded = (_fullDocNeeded || _dirtyNodes.size > _maxPatches
+                         || _dirtyNodes.has(document.documentElement))
+    var patches = []
+    if (!fullDocNeeded) {
+        for (var node of _dirtyNodes) {
+            if (!document.documentElement.contains(node)) {
+                continue
+            }
+            var parent = node.parentElement
+            while (parent && !_dirtyNodes.has(parent)) {
+                parent = parent.parentElement
+            }
+            if (!parent) {
+                patches.push({selector: _getPatchSelector(node), html: node.outerHTML})
+            }
         }
+    }
+    _dirtyNodes.clear()
+    _oldIds.clear()
+    _fullDocNeeded = false
+    if (fullDocNeeded) {
+        return null
+    }
+    return patches
+}
 
-    var select_elements = document.getElementsByTagName("select")
-    for (var select_element of select_elements) {
-        select_element.setAttribute("value", select_element.value)
-        for (var i = 0; i < select_element.options.length; i++) {
-            option = select_element.options[i]
-            if (i == select_element.selectedIndex) {
-                option.setAttribute("selected", "")
-            } else {
-                option.removeAttribute("selected")
+function _getPatchSelector(node) {
+    // The selector of `node` in the document that Python has. The ancestors of a patched element did not change,
+    // so only its own id can differ from that document.
+    if (!_oldIds.has(node)) {
+        return _getElementSelector(node)
+    }
+    var oldId = _oldIds.get(node)
+    var selector = node.nodeName.toLowerCase()
+    if (oldId) {
+        return selector + "#" + oldId
+    }
+    var sib = node, nth = 1
+    while (sib = sib.previousElementSibling) {
+        if (sib.nodeName.toLowerCase() == selector)
+            nth++
+    }
+    if (nth != 1)
+        selector += ":nth-of-type(" + nth + ")"
+    var parent = node.parentElement
+    return parent ? _getElementSelector(parent) + " > " + selector : selector
+}
+
+function _sendDoc(kwargs) {
+    // Sends the whole document when Python could not apply the patches. It contains every change made so far, so
+    // those changes are not sent again as patches.
+    _manageProperties()
+    _addDirtyNodes(_domObserver.takeRecords())
+    _dirtyNodes.clear()
+    _oldIds.clear()
+    _fullDocNeeded = false
+    _send(JSON.stringify({type: "doc", data: _getDoc(), "msg-num": kwargs["msg-num"]}))
+}
+    
+async function _manageProperties() {
+    // Reads the state of every field first, then writes only the attributes that differ from it. Writing an
+    // unchanged attribute would still queue a mutation and turn the field into a patch. Every field is read, because
+    // a value set by a script fires no event and no mutation.
+    var properties = {files: []}
+    var fields = document.querySelectorAll("input, textarea, select")
+    var states = []
+    for (var field of fields) {
+        if (field.tagName === "INPUT") {
+            states.push([field, "value", field.value], [field, "checked", field.checked])
+        } else if (field.tagName === "TEXTAREA") {
+            states.push([field, "value", field.value])
+        } else if (field.tagName === "SELECT") {
+            states.push([field, "value", field.value])
+            for (var i = 0; i < field.options.length; i++) {
+                states.push([field.options[i], "selected", i == field.selectedIndex])
             }
         }
     }
+    for (var [element, name, value] of states) {
+        if (typeof value === "boolean") {
+            if (value && !element.hasAttribute(name)) {
+                element.setAttribute(name, "")
+            } else if (!value && element.hasAttribute(name)) {
+                element.removeAttribute(name)
+            }
+        } else if (element.getAttribute(name) !== value) {
+            element.setAttribute(name, value)
+        }
+    }
     return properties
 }
 
@@ -122,8 +267,8 @@ async function _getFiles(kwargs) {
     var files = []
     var element = _getElement(kwargs['selector'])
     if (element.type == "file") {
+        var selector = _getElementSelector(element)
         for (var file of element.files) {
-            var selector = _getElementSelector(element)
             var fileJSON = {name: file.name,
                              size: file.size,
                              'file-type': file.type,
@@ -134,14 +279,13 @@ async function _getFiles(kwargs) {
                     fileJSON['content'] = text
                 })
             }
-            var keys = Object.keys(_touiFiles)
-            var newKey = 0
-            if (keys.length != 0) {
-                var lastKey = keys.sort().reverse()[0]
-                const newKey = parseInt(lastKey) + 1
+            var newKey = _touiFileIds.get(file)
+            if (newKey === undefined) {
+                newKey = (_touiFileCounter++).toString()
+                _touiFileIds.set(file, newKey)
+                _touiFiles[newKey] = file
             }
-            _touiFiles[newKey.toString()] = file
-            fileJSON['file-id'] = newKey.toString()
+            fileJSON['file-id'] = newKey
             files.push(fileJSON)
         }
     }
@@ -155,18 +299,18 @@ async function _saveFile(kwargs) {
     var file = _touiFiles[fileId]
     var reader = new FileReader()
     if (kwargs['binary'] == true) {
-        reader.onload = function () {
-            const buffer = reader.result
-            const content = new Uint8Array(buffer)
-            const lengthPerPart = 16000
-            const charsLength = content.length
-            for (var i = 0; i < charsLength; i += lengthPerPart) {
-                var smallerContent = [...content.slice(i, i + lengthPerPart)]
-                var jsonString = JSON.stringify({type: "save files",
-                                                  data: smallerContent,
-                                                  end: false,
-                                                  "msg-num": kwargs["msg-num"]})
-                var dataSent = _send(jsonString)
+        reader.onload = async function () {
+            const content = new Uint8Array(reader.result)
+            const lengthPerPart = 1 << 16
+            const bytesLength = content.byteLength
+            for (var i = 0; i < bytesLength; i += lengthPerPart) {
+                await _waitForBufferedAmount()
+                // Each part starts with the message number as 4 bytes, so that Python can tell which file it belongs to
+                var part = content.subarray(i, i + lengthPerPart)
+                var frame = new Uint8Array(4 + part.byteLength)
+                new DataView(frame.buffer).setUint32(0, kwargs["msg-num"])
+                frame.set(part, 4)
+                var dataSent = _send(frame)
             }
             var jsonString = JSON.stringify({type: "save files", data: [], "msg-num": kwargs["msg-num"],
                                               end: true})
@@ -174,34 +318,50 @@ async function _saveFile(kwargs) {
         }
         reader.readAsArrayBuffer(file)
     } else {
-        reader.onload = function () {
-            const content = reader.result
+        reader.onload = async function () {
+            // The file is decoded chunk by chunk, so the whole text is never held as one string
+            const content = new Uint8Array(reader.result)
+            const decoder = new TextDecoder()
             const lengthPerPart = 16000
-            const charsLength = content.length
-            for (var i = 0; i < charsLength; i += lengthPerPart) {
-                var smallerContent = content.substring(i, i + lengthPerPart)
+            const bytesLength = content.byteLength
+            for (var i = 0; i < bytesLength; i += lengthPerPart) {
+                await _waitForBufferedAmount()
+                var smallerContent = decoder.decode(content.subarray(i, i + lengthPerPart), {stream: true})
                 var jsonString = JSON.stringify({type: "save files",
                                                   data: smallerContent,
                                                   "msg-num": kwargs["msg-num"],
                                                   end: false})
                 var dataSent = _send(jsonString)
             }
-            var jsonString = JSON.stringify({type: "save files", data: "", "msg-num": kwargs["msg-num"],
-                                              end: true})
+            var jsonString = JSON.stringify({type: "save files", data: decoder.decode(),
+                                              "msg-num": kwargs["msg-num"], end: true})
             var dataSent = _send(jsonString)
         }
-        reader.readAsText(file)
+        reader.readAsArrayBuffer(file)
     }
 }
     
 function _getElement(selector) {
-    const element = document.querySelector(selector)
+    var element = _elementCache.get(selector)
+    if (!element || !element.isConnected) {
+        // Selectors of elements that have an id are `tag#id`, which `getElementById` resolves directly
+        var match = _idSelector.exec(selector)
+        element = match ? document.getElementById(match[2]) : null
+        if (element === null || element.localName !== match[1]) {
+            element = document.querySelector(selector)
+        }
+        _elementCache.set(selector, element)
+    }
     return element
 }
 
 var _getElementSelector = function(el) {
   if (!(el instanceof Element))
             return;
+        _addDirtyNodes(_domObserver.takeRecords())
+        if (_selectorCache.has(el))
+            return _selectorCache.get(el);
+        var originalEl = el;
         var path = [];
         while (el.nodeType === Node.ELEMENT_NODE) {
             var selector = el.nodeName.toLowerCase();
@@ -222,25 +382,34 @@ var _getElementSelector = function(el) {
             el = el.parentNode;
         }
         path = path.join(" > ");
+        _selectorCache.set(originalEl, path);
         return path;
      }
 
 function _replaceElement(kwargs) {
     var old_element = _getElement(kwargs['selector'])
     old_element.outerHTML = kwargs['element']
+    _elementCache.clear()
     }
 
 function _replaceElements(kwargs) {
+    // All the new elements are parsed at once, each wrapped in its own <template> so that it keeps its nodes
     var elements = document.querySelectorAll(kwargs['selectors'])
-    var pyelements = kwargs['elements']
-    for (i = 0; i < elements.length; i++) {
-        elements[i].outerHTML = pyelements[i];
+    var parser = document.createElement("template")
+    parser.innerHTML = kwargs['elements'].map(element => "<template>" + element + "</template>").join("")
+    var pyelements = parser.content.children
+    for (var i = 0; i < elements.length && i < pyelements.length; i++) {
+        elements[i].replaceWith(pyelements[i].content)
         }
+    _elementCache.clear()
     }
     
 function _setAttr(kwargs) {
     var element = _getElement(kwargs['selector'])
     element.setAttribute(kwargs['name'], kwargs['value'])
+    if (kwargs['name'] == 'id') {
+        _elementCache.clear()
+    }
     if (kwargs['name'] == 'value') {
         element.value = kwargs['value']
     }
@@ -252,6 +421,9 @@ function _setAttr(kwargs) {
 function _delAttr(kwargs) {
     var element = _getElement(kwargs['selector'])
     element.removeAttribute(kwargs['name'])
+    if (kwargs['name'] == 'id') {
+        _elementCache.clear()
+    }
     if (kwargs['name'] == 'checked') {
         element.checked = false
     }
@@ -260,11 +432,13 @@ function _delAttr(kwargs) {
 function _setContent(kwargs) {
     var element = _getElement(kwargs['selector'])
     element.innerHTML = kwargs['content']
+    _elementCache.clear()
 }
 
 function _addContent(kwargs) {
     var element = _getElement(kwargs['selector'])
     element.insertAdjacentHTML("beforeend" ,kwargs['content'])
+    _elementCache.clear()
 }
 
 function _addScript(kwargs) {
@@ -296,45 +470,31 @@ function _resizeEmbed(element) {
     element.style.width = element.contentWindow.document.body.scrollWidth + 1 + 'px'
 }
 
+const _HANDLERS = {_replaceElement, _replaceElements, _setAttr, _delAttr, _setContent, _addContent, _setDoc,
+                   _addScript, _goTo, _getFiles, _saveFile, _sendDoc}
+
+function _registerFunc(name, func) {
+    _HANDLERS[name] = func
+}
+
 function _findAndExecute(jsonString) {
     var instructions = JSON.parse(jsonString)
-    var func = instructions['func']
-    var kwargs = instructions['kwargs']
-    if (func == "_replaceElement") {
-        _replaceElement(kwargs)
-    }
-    if (func == "_replaceElements") {
-        _replaceElements(kwargs)
-    }
-    if (func == "_setAttr") {
-        _setAttr(kwargs)
-    }
-    if (func == "_delAttr") {
-        _delAttr(kwargs)
-    }
-    if (func == "_setContent") {
-        _setContent(kwargs)
-    }
-    if (func == "_addContent") {
-        _addContent(kwargs)
-    }
-    if (func == "_setDoc") {
-        _setDoc(kwargs)
-    }
-    if (func == "_addScript") {
-        _addScript(kwargs)
+    if (!Array.isArray(instructions)) {
+        instructions = [instructions]
     }
-    if (func == "_goTo") {
-        _goTo(kwargs)
-    }
-    if (func == "_getFiles") {
-        _getFiles(kwargs)
-    }
-    if (func == "_saveFile") {
-        _saveFile(kwargs)
+    try {
+        for (const instruction of instructions) {
+            var func = instruction['func']
+            if (Object.prototype.hasOwnProperty.call(_HANDLERS, func)) {
+                _HANDLERS[func](instruction['kwargs'])
+            }
+        }
+    } finally {
+        _elementCache.clear()
     }
 }"""
 
+@lru_cache(maxsize=None)
 def custom_func(name):
     text = f"""
     function {name}(...args) {{
@@ -344,6 +504,17 @@ def custom_func(name):
     return text
 
 
+_scripts = {app_type: template.replace('{app_type}', app_type) for app_type in ('Website', 'DesktopApp')}
+
+
 def get_script(app_type='Website'):
-    script = template.replace('{app_type}', app_type)
-    return script
+    if app_type not in _scripts:
+        _scripts[app_type] = template.replace('{app_type}', app_type)
+    return _scripts[app_type]
+
+
+@lru_cache(maxsize=None)
+def get_script_asset(app_type='Website'):
+    """Returns the script encoded as UTF-8, its gzipped copy and a short hash of it used to version its URL."""
+    data = get_script(app_type).encode()
+    return data, gzip.compress(data, 9), hashlib.blake2b(data, digest_size=8).hexdigest()
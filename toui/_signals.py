@@ -1,17 +1,119 @@
 """
 A module that creates instructions "signals" to allow communicating with JavaScript.
 """
+import heapq
 import inspect
-import json
-from toui._helpers import debug, info
+import itertools
+import threading
+import time
+from toui._helpers import debug, debug_enabled, info, to_json, from_json
+from contextvars import ContextVar
 from copy import copy
 from functools import wraps
 
+# Signals that follow another one within this many seconds are queued, and the queue is sent at the latest this long
+# after its first signal, so that a handler that runs for a while still updates the page as it goes.
+_BATCH_MAX_DELAY = 0.05
+
+
+class _Batch:
+    """
+    Signals sent while a message from JavaScript is handled. A signal is sent right away when nothing was sent in the
+    last `_BATCH_MAX_DELAY` seconds. Bursts of signals are queued and sent together as one JSON array.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.signals = []
+        self.last_sent = 0.0
+        self.scheduled = False
+        self.lock = threading.Lock()
+
+    def add(self, signal):
+        with self.lock:
+            now = time.monotonic()
+            if not self.signals and now - self.last_sent > _BATCH_MAX_DELAY:
+                self._send([signal])
+                return
+            self.signals.append(signal)
+            if debug_enabled():
+                debug(f"QUEUED: {signal}")
+            if not self.scheduled:
+                self.scheduled = True
+                _schedule_flush(self, now + _BATCH_MAX_DELAY)
+
+    def send(self, signal):
+        """Sends the queued signals and then `signal`."""
+        with self.lock:
+            self._flush()
+            self._send([signal])
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.scheduled = False
+        signals, self.signals = self.signals, []
+        if signals:
+            self._send(signals)
+
+    def _send(self, signals):
+        if len(signals) == 1:
+            self.ws.send(to_json(signals[0]))
+        else:
+            self.ws.send(to_json(signals))
+        self.last_sent = time.monotonic()
+        if debug_enabled():
+            debug(f"SENT {len(signals)} SIGNALS")
+
+
+# The batch is only visible in the context that handles the message, so signals sent from other threads (a timer or a
+# progress updater) are sent immediately.
+_current_batch = ContextVar("toui_signal_batch", default=None)
+
+# Batches waiting to be flushed, as a heap of (due time, order, batch). One daemon thread flushes them when due.
+_flush_heap = []
+_flush_order = itertools.count()
+_flush_condition = threading.Condition()
+_flush_thread = None
+
+
+def _schedule_flush(batch, due):
+    global _flush_thread
+    with _flush_condition:
+        heapq.heappush(_flush_heap, (due, next(_flush_order), batch))
+        if _flush_thread is None:
+            _flush_thread = threading.Thread(target=_flush_due_batches, name="toui-signal-flush", daemon=True)
+            _flush_thread.start()
+        _flush_condition.notify()
+
+
+def _flush_due_batches():
+    while True:
+        with _flush_condition:
+            while True:
+                if not _flush_heap:
+                    _flush_condition.wait()
+                    continue
+                remaining = _flush_heap[0][0] - time.monotonic()
+                if remaining > 0:
+                    _flush_condition.wait(remaining)
+                    continue
+                batch = heapq.heappop(_flush_heap)[2]
+                break
+        try:
+            batch.flush()
+        except Exception as e:
+            # The connection closed before the queued signals could be sent.
+            debug(f"Could not send queued signals: {e}")
+
 
 class Signal:
 
     included_private_methods = ["_open_another_page"]
     no_return_functions = []
+    uses_original_copy = True
 
     def __init__(self, return_type=None, app_types=['Website', 'DesktopApp']):
         self.ws = None
@@ -20,10 +122,13 @@ class Signal:
 
     def __call__(decorator, func):
         decorator._func = func
+        decorator._method = decorator._find_method(func)
+        decorator._signature = inspect.signature(func)
         @wraps(func)
         def new_func(self, *args, **kwargs):
             decorator.object = self
-            if self._signal_mode:
+            original_copy = None
+            if self._signal_mode and decorator.uses_original_copy and decorator._method is not None:
                 original_copy = copy(self)
             value = decorator._func(self, *args, **kwargs)
             real_output = value
@@ -32,14 +137,14 @@ class Signal:
                     decorator.ws = self._parent_page.__dict__.get("_ws")
                 elif self.__class__.__name__ == "Page":
                     decorator.ws = self.__dict__.get("_ws")
-                kwargs = inspect.signature(decorator._func).bind(self, *args, **kwargs)
+                kwargs = decorator._signature.bind(self, *args, **kwargs)
                 kwargs.apply_defaults()
                 kwargs = kwargs.arguments
                 kwargs['return_value'] = value
                 kwargs['object'] = kwargs['self']
                 kwargs['original_copy'] = original_copy
                 del kwargs['self']
-                real_output = decorator._call_method(decorator._func, **kwargs)
+                real_output = decorator._call_method(**kwargs)
             if func.__name__ in decorator.no_return_functions:
                 return
             if decorator.return_type == "js":
@@ -47,46 +152,65 @@ class Signal:
             return value
         return new_func
 
-    def _call_method(self, func_, **kwargs):
-        for method_name, method in inspect.getmembers(self, inspect.isfunction):
-            if method_name == func_.__name__ and (not method_name.startswith("_") or
-                                                 method_name in self.included_private_methods):
-                signal = method(**kwargs)
-                if signal:
-                    return self._send(signal)
-                else:
-                    return
+    def _find_method(self, func_):
+        method_name = func_.__name__
+        if method_name.startswith("_") and method_name not in self.included_private_methods:
+            return None
+        method = getattr(self, method_name, None)
+        if inspect.isfunction(method):
+            return method
+        return None
+
+    def _call_method(self, **kwargs):
+        if self._method is None:
+            return
+        signal = self._method(**kwargs)
+        if signal:
+            return self._send(signal)
 
     def _send(self, signal):
         msg_num = self.ws.msg_num = self.ws.msg_num + 1
         signal['kwargs']['msg-num'] = msg_num
-        self.ws.send(json.dumps(signal))
-        debug(f"SENT: {signal}")
+        batch = _current_batch.get()
+        if batch is not None and batch.ws is self.ws:
+            if self.return_type != "js":
+                batch.add(signal)
+                return
+            batch.send(signal)
+        else:
+            self.ws.send(to_json(signal))
+        if debug_enabled():
+            debug(f"SENT: {signal}")
         if self.return_type == "js":
-            valid_message = False
-            while not valid_message:
+            pending_messages = self.ws.pending_messages
+            pending_pages = self.ws.pending_pages
+            while True:
+                if msg_num in pending_messages:
+                    data_dict = pending_messages.pop(msg_num)
+                    break
                 data_from_js = self.ws.receive()
-                debug(f"DATA RECEIVED")
+                debug("DATA RECEIVED")
                 data_validation = self.object._app._validate_data(data_from_js)
                 if not data_validation:
                     info("Data validation returns `False`. The data will not be used.")
                     return
-                data_dict = json.loads(data_from_js)
-                if data_dict.get("msg-num") == msg_num:
-                    valid_message = True
+                if isinstance(data_from_js, bytes):
+                    debug("Ignoring binary data that was not requested")
+                    continue
+                data_dict = from_json(data_from_js)
+                data_msg_num = data_dict.get("msg-num")
+                if data_msg_num == msg_num:
+                    break
+                if data_dict.get("type") == "page":
+                    debug("Adding to pending pages")
+                    pending_pages.append(data_dict)
                 else:
-                    if data_dict.get("type") == "page":
-                        debug("Adding to pending pages")
-                        self.ws.pending_pages.append(data_dict)
-                    else:
-                        self.ws.pending_messages[data_dict.get("msg-num")] = data_dict
-                    debug(f"Non-matching message number: {data_dict.get('msg-num')}, checking for other messages..")
-                    if msg_num in self.ws.pending_messages:
-                        data_dict = self.ws.pending_messages.pop(msg_num)
-                        valid_message = True
-                debug("Could not find message number")
-            debug(f"Message number: {msg_num} found")
-            debug(f"RECEIVED DATA KEYS: {list(data_dict.keys())}")
+                    pending_messages[data_msg_num] = data_dict
+                if debug_enabled():
+                    debug(f"Non-matching message number: {data_msg_num}, checking for other messages..")
+            if debug_enabled():
+                debug(f"Message number: {msg_num} found")
+                debug(f"RECEIVED DATA KEYS: {list(data_dict.keys())}")
             if data_dict['type'] == "files":
                 files = []
                 for file_dict in data_dict['data']:
@@ -95,6 +219,27 @@ class Signal:
             return data_dict['data']
 
 
+def _start_batch(ws):
+    """Starts queuing the signals sent to `ws` in the current context. Returns a token for `_end_batch`."""
+    return _current_batch.set(_Batch(ws))
+
+
+def _end_batch(token):
+    """Sends the queued signals and stops queuing."""
+    batch = _current_batch.get()
+    _current_batch.reset(token)
+    batch.flush()
+
+
+def _send_after_batch(ws, signal):
+    """Sends the signals queued for `ws` in the current context, if any, and then `signal`."""
+    batch = _current_batch.get()
+    if batch is not None and batch.ws is ws:
+        batch.send(signal)
+    else:
+        ws.send(to_json(signal))
+
+
 class File:
     """
     Contains the information of an uploaded file and can be used to save the file contents.
@@ -154,16 +299,18 @@ class File:
 
         msg_num = self._ws.msg_num = self._ws.msg_num + 1
         signal['kwargs']['msg-num'] = msg_num
-        self._ws.send(json.dumps(signal))
-        debug(f"SENT: {signal}")
+        _send_after_batch(self._ws, signal)
+        if debug_enabled():
+            debug(f"SENT: {signal}")
         while True:
             data_dict = self._get_valid_message(msg_num)
             if data_dict is None:
                 break
             data = data_dict['data']
-            if self.is_binary:
-                data = bytearray(data)
-            yield data
+            if self.is_binary and not isinstance(data, bytes):
+                data = bytes(data)
+            if data:
+                yield data
             if data_dict['end'] == True:
                 break
 
@@ -171,29 +318,37 @@ class File:
         return f"<File {self.name}>"
     
     def _get_valid_message(self, msg_num):
-        valid_message = False
-        data_dict = None
-        while not valid_message:
+        pending_messages = self._ws.pending_messages
+        pending_pages = self._ws.pending_pages
+        while True:
+            if msg_num in pending_messages:
+                data_dict = pending_messages.pop(msg_num)
+                break
             data_from_js = self._ws.receive()
-            debug(f"DATA RECEIVED")
+            debug("DATA RECEIVED")
             data_validation = self._app._validate_data(data_from_js)
             if not data_validation:
                 info("Data validation returns `False`. The data will not be used.")
                 return
-            data_dict = json.loads(data_from_js)
-            if data_dict.get("msg-num") == msg_num:
-                valid_message = True
+            if isinstance(data_from_js, bytes):
+                if int.from_bytes(data_from_js[:4], "big") == msg_num:
+                    return {'data': data_from_js[4:], 'end': False}
+                # A part of a file whose saving stopped early
+                debug("Ignoring binary data that was not requested")
+                continue
+            data_dict = from_json(data_from_js)
+            data_msg_num = data_dict.get("msg-num")
+            if data_msg_num == msg_num:
+                break
+            if data_dict.get("type") == "page":
+                debug("Adding to pending pages")
+                pending_pages.append(data_dict)
             else:
-                if data_dict.get("type") == "page":
-                    debug("Adding to pending pages")
-                    self._ws.pending_pages.append(data_dict)
-                else:
-                    self._ws.pending_messages[data_dict.get("msg-num")] = data_dict
-                debug(f"Non-matching message number: {data_dict.get('msg-num')}, checking for other messages..")
-                if msg_num in self._ws.pending_messages:
-                    data_dict = self._ws.pending_messages.pop(msg_num)
-                    valid_message = True
-        debug(f"Message number: {msg_num} found")
+                pending_messages[data_msg_num] = data_dict
+            if debug_enabled():
+                debug(f"Non-matching message number: {data_msg_num}, checking for other messages..")
+        if debug_enabled():
+            debug(f"Message number: {msg_num} found")
         return data_dict
 
     def save(self, stream):
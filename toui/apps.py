@@ -4,31 +4,42 @@ A module that creates web apps and desktop apps.
 import __main__
 import threading
 import json
-import uuid
+import secrets
 import time
 import os
+import heapq
+import hmac
 import requests
 from urllib.parse import urlparse
 from urllib.parse import parse_qs
 from copy import copy
 from abc import ABCMeta, abstractmethod
-from collections import UserDict
+from collections import OrderedDict, deque
 from collections.abc import MutableMapping
-from functools import wraps
+from functools import wraps, partial
 from typing import Any, Union
-from flask import Flask, session, request, send_file, make_response, redirect
+from flask import Flask, session, request, send_file, make_response, redirect, g, after_this_request
 from flask_sock import Sock
-import webview
-from toui._helpers import warn, info, debug, error
-from toui.pages import Page
+from werkzeug.security import generate_password_hash, check_password_hash
+from bs4 import BeautifulSoup
+from toui._helpers import warn, info, debug, debug_enabled, error, to_json, from_json
+from toui.pages import Page, _current_page
+from toui._signals import _start_batch, _end_batch
+from toui._javascript_templates import get_script_asset
 from toui.exceptions import ToUIWrongPlaceException, ToUINotAddedError, ToUIOverlapException
 from toui._defaults import validate_ws, validate_data
 
+# Total length of the cached documents in characters. A parsed tree takes roughly 40 bytes per character of HTML.
+_PARSED_HTML_CACHE_SIZE = 1 << 20
+_MAX_DOWNLOADS = 32
+
 _imported_optional_reqs = {'flask-login':False,
                           'flask-sqlalchemy':False,
                           'flask-basicauth':False,
                           'firebase_admin': False,
-                          'stripe': False}
+                          'stripe': False,
+                          'lxml': False,
+                          'xxhash': False}
 
 try:
     from flask_login import LoginManager, UserMixin, current_user, login_user, logout_user, AnonymousUserMixin
@@ -37,7 +48,7 @@ except ModuleNotFoundError: pass
 
 try:
     from flask_sqlalchemy import SQLAlchemy
-    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.exc import OperationalError, IntegrityError
     _imported_optional_reqs['flask-sqlalchemy'] = True
 except ModuleNotFoundError: pass
 
@@ -62,6 +73,33 @@ try:
     _imported_optional_reqs['stripe'] = True
 except ModuleNotFoundError: pass
 
+try:
+    import lxml
+    _imported_optional_reqs['lxml'] = True
+except ModuleNotFoundError: pass
+
+try:
+    import xxhash
+    _imported_optional_reqs['xxhash'] = True
+except ModuleNotFoundError: pass
+
+
+def _is_password_hash(stored_password):
+    """Checks if a stored password is a hash created by `werkzeug.security.generate_password_hash`."""
+    return stored_password.startswith(("pbkdf2:", "scrypt:"))
+
+
+def _check_password(stored_password, password):
+    """
+    Checks a password against a stored hash. Passwords stored as plain text by older versions are also accepted, and
+    should be replaced by their hash after the user signs in.
+    """
+    if stored_password is None:
+        return False
+    if _is_password_hash(stored_password):
+        return check_password_hash(stored_password, password)
+    return hmac.compare_digest(stored_password.encode(), password.encode())
+
 
 class _ReqsChecker:
 
@@ -137,6 +175,10 @@ class _App(metaclass=ABCMeta):
 
             - `Sock` class extension from `Flask-Sock` package.
 
+            The WebSocket connections are created with the options in ``app.flask_app.config['SOCK_SERVER_OPTIONS']``,
+            which ToUI sets to ``{'ping_interval': 25}``. You can add other options of `simple_websocket.Server`, such as
+            `max_message_size`, before running the app.
+
         """
         self._functions = {}
         if not name:
@@ -155,11 +197,14 @@ class _App(metaclass=ABCMeta):
             warn("No secret key was set. Generating a random secret key for Flask.")
             self.flask_app.secret_key = os.urandom(50)
         self.pages = []
+        self._pages_by_url = {}
         self._add_communication_method()
         self._add_user_vars(timeout_interval=vars_timeout, gen_sid_algo=gen_sid_algo)
-        self.flask_app.route("/toui-download-<path_id>", methods=['POST', 'GET'])(self._download)
+        self.flask_app.route("/toui-download-<int:path_id>", methods=['POST', 'GET'])(self._download)
         self.flask_app.route("/toui-google-sign-in", methods=['POST', 'GET'])(self._sign_in_using_google)
-        self.forbidden_urls = ['/toui-communicate', "/toui-download-<path_id>", "/toui-google-sign-in"]
+        self.flask_app.route("/toui-script.js")(self._script)
+        self.forbidden_urls = ['/toui-communicate', "/toui-download-<int:path_id>", "/toui-google-sign-in",
+                               "/toui-script.js"]
         self.firestore = None
         self._validate_ws = validate_ws
         self._validate_data = validate_data
@@ -169,6 +214,9 @@ class _App(metaclass=ABCMeta):
         self._firebase_app = None
         self._firebase_users_db = None
         self._google_data = {}
+        self._parsed_html = OrderedDict()
+        self._parsed_html_size = 0
+        self._parsed_html_lock = threading.Lock()
 
     @abstractmethod
     def run(self): pass
@@ -203,6 +251,7 @@ class _App(metaclass=ABCMeta):
             page._app = self
             page._add_script()
             self.pages.append(page)
+            self._pages_by_url.setdefault(page.url, page)
             view_func = page._view_func
             if self._auth:
                 view_func = self._auth.required(view_func)
@@ -210,10 +259,8 @@ class _App(metaclass=ABCMeta):
                 endpoint_ = str(id(page))
             else:
                 endpoint_ = endpoint
-            if blueprint:
-                route = blueprint.route(page.url, methods=['GET', 'POST'], endpoint=endpoint_)(view_func)
-            else:
-                route = self.flask_app.route(page.url, methods=['GET', 'POST'], endpoint=endpoint_)(view_func)
+            target = blueprint if blueprint else self.flask_app
+            target.add_url_rule(page.url, endpoint=endpoint_, view_func=view_func, methods=['GET', 'POST'])
 
     def open_new_page(self, url, new=False, different_origin=False):
         """
@@ -250,15 +297,21 @@ class _App(metaclass=ABCMeta):
 
         This function should only be called after the app starts running.
 
+        Warning
+        -------
+        Each call from JavaScript gets its own `Page`. Its document is shared with the later calls from the same
+        browser page, which update it with the changes made in the browser.
+
         Returns
         -------
         pg: Page
 
         """
         try:
-            return session['user page']
+            session.keys()
         except RuntimeError as e:
             raise ToUIWrongPlaceException(f"The function `get_user_page` should only be called after the app runs.")
+        return _current_page.get()
 
     def get_current_url(self):
         """
@@ -322,11 +375,26 @@ class _App(metaclass=ABCMeta):
         new: bool, default=True
             Opens new tab/window when downloading file.
 
+        .. admonition:: Behind The Scenes
+            :class: tip
+
+            The file is sent using `flask.send_file`, which passes it to the WSGI server's file wrapper, so servers
+            such as gunicorn copy it with the `sendfile` system call. If the app runs behind a web server that supports
+            the `X-Sendfile` header, set ``app.flask_app.config['USE_X_SENDFILE'] = True`` to let that server send the
+            file instead.
+
+            Each user keeps the links of their last 32 downloads. Older links stop working.
+
         """
-        path_id = 0
-        while self._user_vars._get(f'toui-download-{path_id}'):
-            path_id += 1
-        self._user_vars._set(f'toui-download-{path_id}', filepath)
+        downloads = self._user_vars._get('toui-downloads')
+        if downloads is None:
+            downloads = {}
+            self._user_vars._set('toui-downloads', downloads)
+        path_id = self._user_vars._get('toui-next-download-id') or 0
+        self._user_vars._set('toui-next-download-id', path_id + 1)
+        downloads[path_id] = filepath
+        if len(downloads) > _MAX_DOWNLOADS:
+            del downloads[next(iter(downloads))]
         self.open_new_page(f"/toui-download-{path_id}", new=new)
 
     @_ReqsChecker(['firebase_admin'])
@@ -583,6 +651,10 @@ class _App(metaclass=ABCMeta):
     def signup_user(self, username, password=None, email=None, **other_info):
         """
         Creates a new user in the database.
+
+        Note
+        ----
+        The password is stored as a salted hash created by `werkzeug.security.generate_password_hash`.
         
         Parameters
         ----------
@@ -604,22 +676,27 @@ class _App(metaclass=ABCMeta):
         self._confirm_user_database_created()
         if self.username_exists(username) or self.email_exists(email):
             return False
+        password_hash = generate_password_hash(password) if password is not None else None
         if self._user_db_type == "sql":
-            new_user = self._user_cls(username=username, password=password, email=email, **other_info)
+            new_user = self._user_cls(username=username, password=password_hash, email=email, **other_info)
             self._db.session.add(new_user)
-            self._db.session.commit()
+            try:
+                self._db.session.commit()
+            except IntegrityError:
+                # Another request created the same username or email after the check above
+                self._db.session.rollback()
+                return False
+            return True
         elif self._user_db_type == "firebase":
             if password is not None:
                 if len(password) < 6:
                     error("Password for Firebase authentication needs to be at least 6 characters")
                     return False
             user_record = firebase_admin.auth.create_user(password=password, display_name=username, email=email)
-            self._firebase_users_db.document(user_record.uid).set({"username": username, 'password': password,
+            self._firebase_users_db.document(user_record.uid).set({"username": username, 'password': password_hash,
                                                                          'email': email, **other_info})
-        if self.username_exists(username) or self.email_exists(email):
             return True
-        else:
-            return False
+        return False
 
     def signin_user(self, username, password=None, email=None, **other_info):
         """
@@ -647,9 +724,13 @@ class _App(metaclass=ABCMeta):
             filter = {"username": username, **other_info}
             if email is not None:
                 filter["email"] = email
-            if password is not None:
-                filter["password"] = password
             user = self._user_cls.query.filter_by(**filter).first()
+            if user and password is not None:
+                if not _check_password(user.password, password):
+                    return False
+                if not _is_password_hash(user.password):
+                    user.password = generate_password_hash(password)
+                    self._db.session.commit()
             if user:
                 login_user(user)
                 self._user_vars._set("user-id", user.id)
@@ -663,9 +744,11 @@ class _App(metaclass=ABCMeta):
                 if len(users) == 0:
                     return False
             if password is not None:
-                users = [user for user in users if user.get("password") == password]
+                users = [user for user in users if _check_password(user.get("password"), password)]
                 if len(users) == 0:
                     return False
+                if not _is_password_hash(users[0].get("password")):
+                    self._firebase_users_db.document(users[0].id).update({'password': generate_password_hash(password)})
             return self.signin_user_from_id(users[0].id, **other_info)
 
     def get_users_ids_from_data(self, **data):
@@ -844,7 +927,7 @@ class _App(metaclass=ABCMeta):
             """
         self._confirm_user_database_created()
         if self._user_db_type == "sql":
-            if self._user_cls.query.filter_by(username=username).first():
+            if self._db.session.query(self._user_cls.id).filter_by(username=username).first() is not None:
                 info(f"User {username} exists")
                 return True
             else:
@@ -873,7 +956,7 @@ class _App(metaclass=ABCMeta):
         if email is None:
             return False
         if self._user_db_type == "sql":
-            if self._user_cls.query.filter_by(email=email).first():
+            if self._db.session.query(self._user_cls.id).filter_by(email=email).first() is not None:
                 info(f"Email {email} exists")
                 return True
             else:
@@ -893,9 +976,11 @@ class _App(metaclass=ABCMeta):
         bool
         """
         self._confirm_user_database_created()
-        if self.user_vars._get('user-id'):
-            if self._user_db_type == "sql":
-                login_user(self._user_cls.query.filter_by(id=self._user_vars._get("user-id")).first())
+        user_id = self._user_vars._get('user-id')
+        if user_id:
+            # Flask-Login loads `current_user` once per request, so the user is only loaded again when it differs
+            if self._user_db_type == "sql" and current_user.get_id() != str(user_id):
+                login_user(self._db.session.get(self._user_cls, user_id))
             return True
         else:
             return False
@@ -1009,7 +1094,8 @@ class _App(metaclass=ABCMeta):
             checkout_url = 'https://www.paypal.com/cgi-bin/webscr?cmd=_express-checkout&token='
         response = requests.post(nvp_url, data=data)
         response_dict = dict(parse_qs(response.text))
-        debug(f"PayPal response: {response_dict}")
+        if debug_enabled():
+            debug(f"PayPal response: {response_dict}")
         if 'Failure' in response_dict['ACK'] or 'FailureWithWarning' in response_dict['ACK']:
             error(f"PayPal error, see the following response: {json.dumps(response_dict, indent=4)}")
         token = response_dict['TOKEN']
@@ -1075,7 +1161,7 @@ class _App(metaclass=ABCMeta):
         response_dict = response.json()
         if response.status_code != 201:
             error(f"PayPal error, see the following response: {json.dumps(response_dict, indent=4)}")
-        else:
+        elif debug_enabled():
             debug(f"PayPal response: {json.dumps(response_dict, indent=4)}")
         url = None
         for link in response_dict['links']:
@@ -1093,8 +1179,10 @@ class _App(metaclass=ABCMeta):
                                  data={'grant_type': 'client_credentials'},
                                  headers={"Content-Type": "application/x-www-form-urlencoded"},
                                  auth=(client_id, client_secret))
-        debug(f"PayPal access token response: {json.dumps(response.json(), indent=4)}")
-        return response.json()['access_token']
+        response_dict = response.json()
+        if debug_enabled():
+            debug(f"PayPal access token response: {json.dumps(response_dict, indent=4)}")
+        return response_dict['access_token']
 
     @_ReqsChecker(['flask-basicauth'])
     def add_restriction(self, username, password):
@@ -1168,7 +1256,8 @@ class _App(metaclass=ABCMeta):
 
         You can check the structures of the data received from JavaScript in
         https://toui.readthedocs.io/en/latest/how_it_works.html#instructions-sent-and-received.
-        Note that the structures of the JSON objects might change in future versions of ToUI.
+        Note that the structures of the JSON objects might change in future versions of ToUI. When a `File` is
+        saved as binary, its content is received as `bytes` instead of JSON.
 
         Parameters
         ----------
@@ -1211,26 +1300,91 @@ class _App(metaclass=ABCMeta):
     def _add_user_vars(self, timeout_interval, gen_sid_algo):
         self._user_vars = _UserVars(self, timeout_interval=timeout_interval, gen_sid_algo=gen_sid_algo)
 
-    def _session_check(self):
+    def _session_check(self) -> bool:
         """This is a private function."""
         try:
             session.keys()
         except RuntimeError as e:
             return False
-        if not "user page" in session.keys():
-            session['user page'] = None
-        if not "_user_id" in session.keys():
+        if "_user_id" not in session:
             user_id = self._user_vars._get('user-id')
             if user_id:
                 session['_user_id'] = user_id
         return True
     
-    def _download(self, path_id):
-        file_to_download = self._user_vars._get(f'toui-download-{path_id}')
+    def _download(self, path_id: int):
+        downloads = self._user_vars._get('toui-downloads')
+        file_to_download = downloads.get(path_id) if downloads else None
         if file_to_download:
-            return send_file(file_to_download, as_attachment=True)
+            return send_file(file_to_download, as_attachment=True, conditional=True)
 
-    def _communicate(self, ws):
+    def _parse_html(self, html_str: str) -> BeautifulSoup:
+        """
+        Parses the HTML document sent from JavaScript. Documents that were parsed recently are copied from a cache
+        instead, because copying the tree is cheaper than parsing the string again. The documents are serialized by
+        the browser, so they can be parsed with lxml if it is installed.
+        """
+        if _imported_optional_reqs['xxhash']:
+            key = xxhash.xxh3_128_digest(html_str.encode())
+        else:
+            # Hits are confirmed below, so the string's own hash is enough and avoids encoding a copy of it
+            key = html_str
+        with self._parsed_html_lock:
+            cached_html, soup = self._parsed_html.get(key, (None, None))
+            if soup is not None:
+                self._parsed_html.move_to_end(key)
+        # The documents come from clients and xxh3 is not collision resistant, so a hit is confirmed before use
+        if soup is None or cached_html != html_str:
+            features = "lxml" if _imported_optional_reqs['lxml'] else "html.parser"
+            soup = BeautifulSoup(html_str, features=features)
+            if len(html_str) <= _PARSED_HTML_CACHE_SIZE:
+                with self._parsed_html_lock:
+                    replaced_html, _ = self._parsed_html.pop(key, ("", None))
+                    self._parsed_html[key] = (html_str, soup)
+                    self._parsed_html_size += len(html_str) - len(replaced_html)
+                    while self._parsed_html_size > _PARSED_HTML_CACHE_SIZE:
+                        removed_html, _ = self._parsed_html.popitem(last=False)[1]
+                        self._parsed_html_size -= len(removed_html)
+        new_soup = BeautifulSoup("", features="html.parser")
+        for child in soup.contents:
+            new_soup.append(copy(child))
+        return new_soup
+
+    def _script(self):
+        """This is a private function."""
+        data, gzipped_data, _ = get_script_asset(self.__class__.__name__)
+        if "gzip" in request.accept_encodings:
+            response = make_response(gzipped_data)
+            response.headers['Content-Encoding'] = "gzip"
+        else:
+            response = make_response(data)
+        response.headers['Content-Type'] = "text/javascript; charset=utf-8"
+        response.headers['Cache-Control'] = "public, max-age=31536000, immutable"
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def _receive_message(self, ws, timeout=None) -> bool:
+        """
+        Receives a message from JavaScript and queues it if it calls a Python function. Returns ``False`` if no message
+        arrived before the timeout. This is a private function.
+        """
+        data_from_js = ws.receive(timeout=timeout)
+        if data_from_js is None:
+            return False
+        # The default validator accepts everything, so calling it for every message is skipped.
+        validate = self._validate_data
+        if validate is not validate_data and not validate(data_from_js):
+            info("Data validation returns `False`. The data will not be used.")
+            return True
+        if isinstance(data_from_js, bytes):
+            debug("Ignoring binary data that was not requested")
+            return True
+        data_dict = from_json(data_from_js)
+        if data_dict.get("type") == "page":
+            ws.pending_pages.append(data_dict)
+        return True
+
+    def _communicate(self, ws) -> None:
         """This is a private function."""
         validation = self._validate_ws(ws)
         if not validation:
@@ -1239,60 +1393,80 @@ class _App(metaclass=ABCMeta):
         info(f'WebSocket connected: {ws.connected}')
         ws.msg_num = 0
         ws.pending_messages = {}
-        ws.pending_pages = []
+        ws.pending_pages = pending_pages = deque()
+        ws.html = None
+        # The connection keeps one request context, so the default `_gen_sid` resolves the sid here and returns it
+        # from `flask.g` for every message that reads user variables.
+        self._user_vars._gen_sid()
+        connection_page = Page()
+        connection_page._app = self
+        connection_page._signal_mode = True
+        connection_page._ws = ws
+        receive_message = self._receive_message
+        session_check = self._session_check
+        parse_html = self._parse_html
+        # Documents are parsed on this thread. simple_websocket reads frames from the socket on its own thread, so
+        # parsing does not delay their arrival. BeautifulSoup builds its tree in Python while holding the GIL, and
+        # messages must run in order, so handing the parsing to a thread or process pool would not speed it up.
+        # Frames that arrived meanwhile are drained from its buffer with ``timeout=0`` before processing; polling the
+        # socket directly with `select` would compete with that thread for the same data.
         while True:
-            valid_message = False
-            while not valid_message:
-                data_from_js = ws.receive()
-                data_validation = self._validate_data(data_from_js)
-                if not data_validation:
-                    info("Data validation returns `False`. The data will not be used.")
-                    continue
-                s = time.time()
-                data_dict = json.loads(data_from_js)
-                if data_dict.get("type") == "page":
-                    ws.pending_pages.append(data_dict)
-                    valid_message = True
-            while True:
-                if len(ws.pending_pages) == 0:
-                    break
-                data_dict = ws.pending_pages.pop(0)
-                self._session_check()
+            while not pending_pages:
+                receive_message(ws)
+            while receive_message(ws, timeout=0):
+                pass
+            timing = debug_enabled()
+            if timing:
+                s = time.perf_counter()
+            while pending_pages:
+                data_dict = pending_pages.popleft()
+                session_check()
                 func = data_dict['func']
                 args = data_dict['args']
-                url = data_dict['url']
-                new_html = data_dict['html']
-                new_page = Page(url=url)
-                new_page.from_str(new_html)
-                new_page._app = self
-                new_page._signal_mode = True
-                new_page._ws = ws
-                new_page._inherit_functions()
-                selector_to_element = data_dict['selector-to-element']
-                if selector_to_element:
-                    for index, arg in enumerate(args):
-                        if type(arg) is dict:
-                            if arg.get('type') == "element":
-                                args[index] = new_page.get_element_from_selector(arg['selector'])
-                if "uid" in data_dict:
-                    new_page._uid = data_dict['uid']
-                session['user page'] = new_page
+                new_page = connection_page._new_message_page(data_dict['url'])
+                html = data_dict.get('html')
+                if html is None:
+                    new_page._html = ws.html
+                    if ws.html is None or not new_page._apply_patches(data_dict['patches']):
+                        debug("Could not apply the changes sent from JavaScript, requesting the full document")
+                        html = new_page._get_doc()
+                        if html is None:
+                            info("The document could not be received from JavaScript. The message will not be used.")
+                            continue
+                        # The document is newer than the messages that are still queued, so it already contains
+                        # their changes
+                        for queued_dict in pending_pages:
+                            if 'patches' in queued_dict:
+                                queued_dict['patches'] = []
+                if html is not None:
+                    new_page._html = parse_html(html)
+                if data_dict['selector-to-element']:
+                    # The script lists the positions of the elements, other clients might only send the flag
+                    element_args = data_dict.get('element-args')
+                    if element_args is None:
+                        element_args = range(len(args))
+                    for index in element_args:
+                        arg = args[index]
+                        if type(arg) is dict and arg.get('type') == "element":
+                            args[index] = new_page.get_element_from_selector(arg['selector'])
+                new_page._uid = data_dict.get('uid')
+                token = _current_page.set(new_page)
+                batch_token = _start_batch(ws)
                 try:
-                    if new_page._func_exists(func):
-                        new_page._call_func(func, *args)
-                    del session['user page']
-                except Exception as e:
-                    del session['user page']
-                    raise e
-                e = time.time()
-                debug(f"TIME: {e - s}s")
+                    new_page._call_func(func, *args)
+                    ws.html = new_page._html
+                finally:
+                    _end_batch(batch_token)
+                    _current_page.reset(token)
+                if timing:
+                    debug(f"TIME: {time.perf_counter() - s}s")
 
     def _confirm_user_database_created(self):
         if self._user_db_type is None:
             raise ToUINotAddedError("You have not created the user database yet. To create it, call the method: `add_user_database_using_sql` or `add_user_database_using_firebase`.")
 
     def _load_user(self, user_id):
-        return self._user_cls.query.filter_by(id=int(user_id)).first()
+        return self._db.session.get(self._user_cls, int(user_id))
     
     def _get_user_details_from_google_token(self, access_token, refresh_token=None):
         headers = {"Authorization": f"Bearer {access_token}"}
@@ -1399,86 +1573,114 @@ class _App(metaclass=ABCMeta):
             return redirect(redirect_to)
 
 
-class _FuncWithPage:
-    """Currently this class is unused, but it might be used later."""
-    def __init__(self, func, page):
-        self.func = func
-        self.page = page
-    def __call__(self, *args, **kwargs):
-        return self.func(*args, **kwargs)
-
-
 class _UserVars(MutableMapping):
     """User-specific variables"""
 
     def __init__(self, app, timeout_interval, gen_sid_algo) -> None:
         self._app = app
-        self._cache = UserDict()
-        self._cache.set = self._cache.__setitem__
+        self._cache = {}
         self._default_vars = {}
         self._timeout_interval = timeout_interval
+        self._expiry_heap = []
+        self._expiry_cond = threading.Condition()
+        self._expiry_thread = None
         if gen_sid_algo:
             self._gen_sid = gen_sid_algo
 
     def _gen_sid(self):
         try:
-            if request.cookies.get('TOUI_SID'):
-                sid = request.cookies.get('TOUI_SID')
-                session['toui-sid'] = sid
+            # The sid does not change within a request, so it is resolved once and kept on `flask.g`.
+            sid = g.get('_toui_sid')
+            if sid is not None:
+                return sid
+            sid = request.cookies.get('TOUI_SID')
+            if sid:
+                if session.get('toui-sid') != sid:
+                    session['toui-sid'] = sid
             else:
                 if "toui-sid" in session:
                     sid = session['toui-sid']
                 else:
-                    sid = str(uuid.uuid4())
+                    sid = secrets.token_urlsafe(24)
                     session['toui-sid'] = sid
-                response = make_response()
-                response.set_cookie("TOUI_SID", sid, secure=True, httponly=True)
-                session['toui-response'] = response
+                after_this_request(partial(self._set_sid_cookie, sid))
+            g._toui_sid = sid
             return sid
         except RuntimeError:
             return None
         
+    @staticmethod
+    def _set_sid_cookie(sid, response):
+        response.set_cookie("TOUI_SID", sid, secure=True, httponly=True)
+        return response
+
     def _timeout(self, sid):
-        self._cache.delete(sid)
+        self._cache.pop(sid, None)
 
-    def _sid_check(self):
+    def _schedule_timeout(self, sid):
+        """
+        Schedules the deletion of the user's variables. A single daemon thread handles all sessions instead of one
+        timer thread per session.
+        """
+        with self._expiry_cond:
+            heapq.heappush(self._expiry_heap, (time.monotonic() + self._timeout_interval, sid))
+            if self._expiry_thread is None:
+                self._expiry_thread = threading.Thread(target=self._expire_sessions, daemon=True)
+                self._expiry_thread.start()
+            self._expiry_cond.notify()
+
+    def _expire_sessions(self):
+        with self._expiry_cond:
+            while True:
+                if not self._expiry_heap:
+                    self._expiry_cond.wait()
+                    continue
+                remaining = self._expiry_heap[0][0] - time.monotonic()
+                if remaining > 0:
+                    self._expiry_cond.wait(remaining)
+                    continue
+                _, sid = heapq.heappop(self._expiry_heap)
+                self._timeout(sid)
+
+    def _get_user_dict(self):
+        """Returns the dictionary of the current user, or ``None`` outside of a request."""
         sid = self._gen_sid()
         if sid:
             user_dict = self._cache.get(sid)
             if user_dict is None:
-                self._cache.set(sid, {"toui-vars": self._default_vars.copy()})
-                threading.Timer(self._timeout_interval, self._timeout, args=[sid]).start()
-            return sid
+                new_dict = {"toui-vars": self._default_vars.copy()}
+                user_dict = self._cache.setdefault(sid, new_dict)
+                if user_dict is new_dict:
+                    self._schedule_timeout(sid)
+            return user_dict
 
     def _get_toui_vars(self):
-        sid = self._sid_check()
-        if sid:
-            return self._cache.get(sid)['toui-vars']
+        user_dict = self._get_user_dict()
+        if user_dict is not None:
+            return user_dict['toui-vars']
         else:
             return self._default_vars
 
     def _get(self, key):
-        sid = self._sid_check()
-        if sid:
-            return self._cache.get(sid).get(key)
+        user_dict = self._get_user_dict()
+        if user_dict is not None:
+            return user_dict.get(key)
         else:
             return self._default_vars
     
     def _set(self, key, value):
         """Avoid key='toui-vars'"""
-        sid = self._sid_check()
-        if sid:
-            sid_dict = self._cache.get(sid)
-            sid_dict[key] = value
+        user_dict = self._get_user_dict()
+        if user_dict is not None:
+            user_dict[key] = value
         else:
             self._default_vars[key] = value
 
     def _del(self, key):
-        sid = self._sid_check()
-        if sid:
-            sid_dict = self._cache.get(sid)
-            if key in sid_dict:
-                del sid_dict[key]
+        user_dict = self._get_user_dict()
+        if user_dict is not None:
+            if key in user_dict:
+                del user_dict[key]
         else:
             if key in self._default_vars:
                 del self._default_vars[key]
@@ -1585,9 +1787,10 @@ class DesktopApp(_App):
 
     """
     def _run_server(self):
-        self.flask_app.run(port=self._port, use_reloader=False)
+        # Each request and WebSocket connection gets its own thread, so a long-lived connection does not block the
+        # window's other requests. A gevent server would need monkey patching before anything else is imported.
+        self.flask_app.run(host="127.0.0.1", port=self._port, threaded=True, use_reloader=False)
 
-    @wraps(webview.start)
     def run(self, *args, **kwargs):
         """
         Runs the app. It calls the function `webview.start`. The arguments will be passed to
@@ -1600,6 +1803,8 @@ class DesktopApp(_App):
         kwargs: Any
 
         """
+        # pywebview is imported when a desktop app starts, so that websites do not pay for importing it
+        import webview
         if len(self.pages) == 0:
             raise Exception("Cannot run the app because no pages were added.")
         self._port = webview.http._get_random_port()
@@ -4,15 +4,16 @@ A module that creates web pages or windows.
 import os
 import time
 from bs4 import BeautifulSoup
-import webview
-import json
-from flask import session, redirect, request, Response
+from flask import session, redirect, request
 from toui.elements import Element
-from toui._javascript_templates import custom_func, get_script
+from toui._javascript_templates import custom_func, get_script_asset
 from copy import copy
-from toui._helpers import warn, info, debug, selector_to_str, obj_converter
+from contextvars import ContextVar
+from toui._helpers import warn, info, debug, selector_to_str, obj_converter, to_json
 from toui._signals import Signal
 
+_current_page = ContextVar("toui_current_page", default=None)
+
 
 class _PageSignal(Signal):
     """
@@ -21,7 +22,9 @@ class _PageSignal(Signal):
     These signals are related the methods of the `Page` object.
     """
 
+    included_private_methods = ["_open_another_page", "_get_doc"]
     no_return_functions = ["add_function"]
+    uses_original_copy = False
 
     @staticmethod
     def from_str(**kwargs):
@@ -47,6 +50,13 @@ class _PageSignal(Signal):
         js_kwargs = {"script": value}
         return {'func': js_func, 'args': js_args, 'kwargs': js_kwargs}
 
+    @staticmethod
+    def _get_doc(**kwargs):
+        js_func = "_sendDoc"
+        js_args = []
+        js_kwargs = {}
+        return {'func': js_func, 'args': js_args, 'kwargs': js_kwargs}
+
     @staticmethod
     def _open_another_page(**kwargs):
         js_func = "_goTo"
@@ -152,6 +162,7 @@ class Page:
         self._signal_mode = False
         self._signals = []
         self._functions = {}
+        self._functions_shared = False
         self._view_func = self._on_url_request
         self._uid = None
         self._navigation_bar = ""
@@ -164,8 +175,10 @@ class Page:
         return self.to_str()
 
     def __copy__(self):
-        new_pg = Page(html_file=self._html_file, url=self.url)
-        new_pg.from_bs4_soup(self.to_bs4_soup())
+        # The document is copied once, instead of reading the HTML file again and copying the soup twice.
+        new_pg = Page(url=self.url)
+        new_pg._html_file = self._html_file
+        new_pg._html = copy(self._html)
         new_pg._signal_mode = self._signal_mode
         new_pg._navigation_bar = self._navigation_bar
         new_pg._footer = self._footer
@@ -465,9 +478,12 @@ class Page:
                  f"because they might overlap with functions used by the package.")
         if self._func_exists(name):
             warn(f"Function '{name}' exists.")
-        old_functions = copy(self._functions)
+        existed = name in self._functions
+        if self._functions_shared:
+            self._functions = dict(self._functions)
+            self._functions_shared = False
         self._functions[name] = func
-        if func.__name__ in old_functions:
+        if existed:
             return ""
         script_element = Element("script")
         script_element.set_content(custom_func(func.__name__))
@@ -540,17 +556,18 @@ class Page:
             self._footer = html_str
 
     def get_window(self):
+        import webview
         for window in webview.windows:
             if window.uid == self._uid:
                 return window
             
     def _on_url_request(self, func=None, display_return_value=False):
         self._app._user_vars._gen_sid()
-        session['user page'] = copy(self)
+        token = _current_page.set(copy(self))
         session['toui-request-url'] = request.url
         session['toui-page-vars'] = {}
         try:
-            pg = session['user page']
+            pg = _current_page.get()
             body_element = pg.get_body_element()
             if body_element:
                 body_element.set_content(pg._navigation_bar + body_element.to_str()) 
@@ -560,37 +577,16 @@ class Page:
             if func:
                 new_return = func()
                 if display_return_value:
-                    del session['user page']
-                    if "toui-response" in session:
-                        response = session['toui-response']
-                        if isinstance(new_return, Response):
-                            response.set_data(new_return.get_data())
-                        else:
-                            response.set_data(new_return)
-                        del session['toui-response']
-                        return response
-                    else:   
-                        return new_return
-            pg = session['user page']
-            del session['user page']
-            if "toui-response" in session:
-                response = session['toui-response']
-                response.set_data(pg.to_str())
-                del session['toui-response']
-                return response
-            else:
-                return pg.to_str()
-        except Exception as e:
-            if 'user page' in session:
-                del session['user page']
-            if 'toui-response' in session:
-                del session['toui-response']
-            raise e
+                    return new_return
+            pg = _current_page.get()
+            return pg.to_str()
+        finally:
+            _current_page.reset(token)
 
     def _add_script(self):
         script_tag = Element("script")
-        script_content = get_script(self._app.__class__.__name__)
-        script_tag.set_content(script_content)
+        script_version = get_script_asset(self._app.__class__.__name__)[2]
+        script_tag.set_attr("src", f"/toui-script.js?v={script_version}")
         self.get_elements(tag_name="html")[0].add_content(script_tag)
 
     def _create_window(self):
@@ -605,6 +601,7 @@ class Page:
                 warn(f"The window will load the URL '{value}' instead of '{self.url}' because it was set in `default_windows`.")
                 url = value
                 del window_defaults['url']
+        import webview
         window = webview.create_window(title=title, url=url, **window_defaults)
         self._uid = window.uid
         debug(f"UID of window: {self._uid}")
@@ -620,7 +617,7 @@ class Page:
             nonlocal data_from_js
             data_from_js = result
         codejs = f"""
-        var kwargs = JSON.parse(\'{json.dumps(kwargs)}\')
+        var kwargs = JSON.parse(\'{to_json(kwargs)}\')
         {func}(kwargs)
         """
         debug("EVALUATE: " + codejs)
@@ -642,28 +639,70 @@ class Page:
                 window.load_url(full_url)
                 return window
             
-    def _inherit_functions(self):
-        for page in self._app.pages:
-            if page.url == self.url:
-                self._functions.update(page._functions)
-                return
-            
-    def _get_functions(self):
+    def _apply_patches(self, patches):
+        """
+        Replaces the elements that changed in JavaScript. Returns ``False`` without changing the document if one of
+        them was not found.
+        """
+        replacements = []
+        for patch in patches:
+            bs4_tag = self._html.select_one(patch['selector'])
+            new_tag = BeautifulSoup(patch['html'], features="html.parser").find()
+            if bs4_tag is None or new_tag is None:
+                return False
+            replacements.append((bs4_tag, new_tag))
+        for bs4_tag, new_tag in replacements:
+            bs4_tag.replace_with(new_tag)
+        return True
+
+    @_PageSignal(return_type="js")
+    def _get_doc(self):
+        """
+        Gets the whole document from JavaScript. Returns ``None`` when the page is not connected to JavaScript. This is
+        a private function.
+        """
+        return None
+
+    def _new_message_page(self, url):
+        """
+        Creates the page that handles one message of a WebSocket connection. This page holds the attributes shared by
+        the messages of the connection, and they are copied to the new page without parsing any HTML. This is a
+        private function.
+        """
+        new_pg = Page.__new__(Page)
+        new_pg.__dict__.update(self.__dict__)
+        new_pg.window_defaults = {}
+        new_pg._signals = []
+        new_pg._view_func = new_pg._on_url_request
+        new_pg.url = url
+        page = self._app._pages_by_url.get(url)
+        if page is None:
+            new_pg._functions = {}
+            new_pg._functions_shared = False
+        else:
+            # The functions of the registered page are used directly. `add_function` copies them before adding one.
+            new_pg._functions = page._functions
+            new_pg._functions_shared = True
+        return new_pg
+
+    def _get_functions(self) -> dict:
         """Gets all added functions in this class. This is a private function."""
         return self._functions
 
-    def _func_exists(self, func_name: str):
+    def _func_exists(self, func_name: str) -> bool:
         """Checks if a function exists. This is a private function."""
-        if func_name in self._get_functions().keys():
-            return True
-        else:
-            return False
+        return func_name in self._get_functions()
 
-    def _call_func(self, func_name, *args, page=None):
-        """Calls a function in this class. Its return value depends on the function called. This is a private function."""
-        functions = self._get_functions()
+    def _call_func(self, func_name: str, *args):
+        """
+        Calls a function in this class if it exists. Its return value depends on the function called. This is a
+        private function.
+        """
+        function = self._get_functions().get(func_name)
+        if function is None:
+            return None
         info(f'"{func_name}" called')
-        return functions[func_name](*args)
+        return function(*args)
     
 
 class RedirectingPage(Page):